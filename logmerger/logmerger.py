@@ -270,7 +270,7 @@ class LogMergerApplication:
                 label(
                     fname,
                     MultilineLogCollapser(self.time_clip)(
-                        filter(self._raw_time_clip, map(xformer, map(str.rstrip, reader)))
+                        filter(self._raw_time_clip, xformer.transform_iter(map(str.rstrip, reader)))
                     )
                 )
             ) for fname, xformer, reader in zip(self.file_names, transformers, readers)
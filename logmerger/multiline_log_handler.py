@@ -87,5 +87,5 @@ if __name__ == '__main__':
     log_lines = (Path("files") / "log1.txt").read_text().splitlines()
     transformer = TimestampedLineTransformer.make_transformer_from_sample_line(log_lines[0])
 
-    for collapsed in MultilineLogCollapser()(transformer(line) for line in log_lines):
+    for collapsed in MultilineLogCollapser()(transformer.transform_iter(log_lines)):
         print(collapsed)
@@ -1,18 +1,77 @@
 from __future__ import annotations
 
+from collections.abc import Generator, Iterable
 import os
 import string
-from datetime import datetime
-from functools import partial
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+import itertools
 from pathlib import Path
 import re
+import sys
 from typing import Callable, TypeVar, Union
 
 
 T = TypeVar("T")
 TimestampFormatter = Union[Union[str, Callable[[str], datetime]]]
 
-strip_escape_sequences = partial(re.compile("\x1b" + r"\[\d+(;\d+)*m").sub, "")
+
+@lru_cache(maxsize=256)
+def _compile(pattern: str) -> re.Pattern:
+    # share compiled patterns between a subclass and all of its transformer instances
+    return re.compile(pattern)
+
+
+# (a hand-written find/slice/join stripper was 1.5-4x slower than this regex in testing,
+# on both short and long lines, since the regex scans for its leading ESC literal in C)
+strip_escape_sequences = partial(re.compile(r"\x1b\[\d+(?:;\d+)*m").sub, "")
+
+
+def _strip_esc(s: str) -> str:
+    # most log lines have no escape sequences, so skip the regex scan if there is no ESC char
+    return strip_escape_sequences(s) if "\x1b" in s else s
+
+
+# datetime.fromisoformat only accepts "," as the fractional seconds separator on Python 3.11+,
+# so for earlier versions translate it to "." first
+if sys.version_info >= (3, 11):
+    _fromisoformat_comma = datetime.fromisoformat
+else:
+    _COMMA_TO_DOT = str.maketrans(",", ".")
+
+    def _fromisoformat_comma(s: str) -> datetime:
+        return datetime.fromisoformat(s.translate(_COMMA_TO_DOT))
+
+
+# Parsers for fixed-layout timestamps, which build the datetime directly from string
+# slices instead of having strptime re-interpret the format string for every line.
+# Month names are English abbreviations, as written by syslog and HTTP servers.
+_MONTH_NUMBERS = {
+    mon: i for i, mon in enumerate("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), start=1)
+}
+
+
+def _parse_bdhms(s: str) -> datetime:
+    # "Jul 14 08:00:02" or "Jul  4 08:00:02" - equivalent to strptime format "%b %d %H:%M:%S"
+    return datetime(1900, _MONTH_NUMBERS[s[:3]], int(s[4:6]), int(s[7:9]), int(s[10:12]), int(s[13:15]))
+
+
+def _parse_dby_hms(s: str) -> datetime:
+    # "22/Sep/2023 21:58:40" - equivalent to strptime format "%d/%b/%Y %H:%M:%S"
+    day, mon, rest = s.split("/")
+    return datetime(int(rest[:4]), _MONTH_NUMBERS[mon], int(day), int(rest[5:7]), int(rest[8:10]), int(rest[11:13]))
+
+
+def _parse_dby_hms_tz(s: str) -> datetime:
+    # "16/Sep/2023:19:05:06 +0000" - equivalent to strptime format "%d/%b/%Y:%H:%M:%S %z"
+    day, mon, rest = s.split("/")
+    tz_offset = timedelta(hours=int(rest[15:17]), minutes=int(rest[17:19]))
+    if rest[14] == "-":
+        tz_offset = -tz_offset
+    return datetime(
+        int(rest[:4]), _MONTH_NUMBERS[mon], int(day), int(rest[5:7]), int(rest[8:10]), int(rest[11:13]),
+        tzinfo=timezone(tz_offset),
+    )
 
 
 class TimestampedLineTransformer:
@@ -20,6 +79,12 @@ class TimestampedLineTransformer:
     Class to detect timestamp formats, and auto-transform lines that start with that timestamp into
     (timestamp, rest of the line) tuples.
     """
+    # subclasses must also define __slots__ (usually empty), or their instances will get a __dict__
+    __slots__ = (
+        "_re_pattern_match", "_re_pattern_sub", "_clip_prefix", "str_to_time", "_finalize",
+        "file_info", "file_stat", "_ctime_year",
+    )
+
     pattern = ""
     timestamp_pattern = ""
     timestamp_match_group = 2
@@ -27,16 +92,26 @@ class TimestampedLineTransformer:
     strptime_format = ""
     match = lambda s: False
     has_timezone = False
+    # literal text that any matching line must contain, for patterns that must scan the
+    # whole line to find the timestamp
+    required_text = ""
 
     custom_transformers = []
     custom_transformer_suffixes = iter(string.ascii_uppercase)
 
+    # combined alternation of all subclass patterns, built on first use by _build_combined_matcher
+    _combined_match = None
+    _combined_group_classes = {}
+
     def __init_subclass__(cls):
-        cls.match = re.compile(cls.pattern).match
+        cls.match = _compile(cls.pattern).match
+
+        # new subclasses (including custom transformers) must be included in the combined matcher
+        TimestampedLineTransformer._combined_match = None
 
     @staticmethod
     def _get_first_line_of_file(file_ref) -> str:
-        if isinstance(file_ref, (str, Path)):
+        if isinstance(file_ref, (str, os.PathLike)):
             with open(file_ref) as log_file:
                 first_line = log_file.readline()
         else:
@@ -47,14 +122,46 @@ class TimestampedLineTransformer:
     def make_transformer_from_file(cls, file_ref) -> TimestampedLineTransformer:
         first_line = cls._get_first_line_of_file(file_ref)
         xformer = cls.make_transformer_from_sample_line(first_line)
-        xformer.add_file_info(Path(file_ref))
+        # os.DirEntry objects (from os.scandir) already have cached stat info, so pass them as-is
+        xformer.add_file_info(file_ref if isinstance(file_ref, os.DirEntry) else Path(file_ref))
         return xformer
 
+    @classmethod
+    def _build_combined_matcher(cls) -> None:
+        """
+        Compile the patterns of all subclasses into a single regex of named alternatives,
+        so that a sample line can be tested against every timestamp format in one pass.
+        Alternatives are in subclass definition order, so that the first matching
+        subclass is selected, just as if each subclass were tested in turn.
+
+        This order must not be changed (for instance, to put the most frequently matched
+        formats first), since some patterns overlap - a proxied HTTP log line such as
+        "2023-07-14 08:00:01 proxy - [14/Jul/2023 09:15:00] GET /" matches both YMDHMS
+        and PythonHttpServerLog, and the leading timestamp must win.
+        """
+        group_classes = {f"_{i}": subcls for i, subcls in enumerate(TimestampedLineTransformer.__subclasses__())}
+        combined_pattern = "|".join(f"(?P<{name}>{subcls.pattern})" for name, subcls in group_classes.items())
+        try:
+            TimestampedLineTransformer._combined_match = re.compile(combined_pattern).match
+        except re.error:
+            # some custom pattern cannot be combined with the others (such as one that
+            # defines its own named groups), so fall back to testing each subclass in turn
+            TimestampedLineTransformer._combined_match = False
+        TimestampedLineTransformer._combined_group_classes = group_classes
+
     @classmethod
     def make_transformer_from_sample_line(cls, s: str) -> TimestampedLineTransformer:
-        for subcls in cls.__subclasses__():
-            if subcls.match(s):
-                return subcls()
+        if TimestampedLineTransformer._combined_match is None:
+            cls._build_combined_matcher()
+
+        if TimestampedLineTransformer._combined_match:
+            m = TimestampedLineTransformer._combined_match(s)
+            if m:
+                return TimestampedLineTransformer._combined_group_classes[m.lastgroup]()
+        else:
+            for subcls in TimestampedLineTransformer._combined_group_classes.values():
+                if subcls.match(s):
+                    return subcls()
         raise ValueError(f"no match for any timestamp pattern in {s!r}")
 
     @classmethod
@@ -98,10 +205,7 @@ class TimestampedLineTransformer:
             raise ValueError(f"custom timestamp format '{custom_timestamp}' must contain '(...)' placeholder")
 
         has_initial_content = "..." not in custom_timestamp[:custom_timestamp.find(")")]
-        for subcls in TimestampedLineTransformer.__subclasses__():
-            if subcls in TimestampedLineTransformer.custom_transformers:
-                continue
-
+        for subcls in _BUILTIN_SUBCLASSES:
             custom_timestamp_pattern = custom_timestamp.replace("...", subcls.timestamp_pattern)
             class_properties = {
                 "pattern": custom_timestamp_pattern,
@@ -109,6 +213,8 @@ class TimestampedLineTransformer:
                 "timestamp_match_group": 3 if has_initial_content else 2,
                 "sub_repl": r"\1" if has_initial_content else "",
                 "strptime_format": subcls.strptime_format,
+                "required_text": "",
+                "__slots__": (),
             }
 
             name_suffix = next(cls.custom_transformer_suffixes)
@@ -121,21 +227,46 @@ class TimestampedLineTransformer:
             )
 
     def __init__(self, pattern: str, strptime_formatter: TimestampFormatter):
-        self._re_pattern_match = re.compile(pattern).match
-        self._re_pattern_sub = partial(re.compile(pattern).sub, count=1)
-        self.pattern: str = pattern
+        re_pattern = _compile(pattern)
+        required_text = self.required_text
+        if required_text:
+            # skip the (slow, backtracking) regex for lines that cannot match
+            # (making the leading (.*) possessive to prevent backtracking is not an option,
+            # since the pattern needs the backtracking to find the timestamp at all)
+            self._re_pattern_match = lambda s: re_pattern.match(s) if required_text in s else None
+        else:
+            self._re_pattern_match = re_pattern.match
+        self._re_pattern_sub = re_pattern.sub
+        # if nothing gets substituted for the matched text, clip it off by slicing instead of
+        # running the regex a second time (match() is anchored at the start of the line, so
+        # the first match that sub() would find is the same one)
+        self._clip_prefix = self.sub_repl == ""
 
         if isinstance(strptime_formatter, str):
             self.str_to_time = lambda s: datetime.strptime(s, strptime_formatter)
         else:
             self.str_to_time = strptime_formatter
 
-        self.file_info: Path = None  # noqa
+        # timezone-aware timestamps get converted to naive local time
+        self._finalize = self._finalize_tz if self.has_timezone else self._finalize_naive
+
+        self.file_info: Path | os.DirEntry = None  # noqa
         self.file_stat: os.stat_result = None  # noqa
+        self._ctime_year: int = datetime.now().year
+
+    @staticmethod
+    def _finalize_tz(dt: datetime) -> datetime:
+        return dt.astimezone().replace(tzinfo=None)
 
-    def add_file_info(self, file_info: Path):
+    @staticmethod
+    def _finalize_naive(dt: datetime) -> datetime:
+        return dt
+
+    def add_file_info(self, file_info: Path | os.DirEntry):
         self.file_info = file_info
         self.file_stat = file_info.stat()
+        if self.file_stat.st_ctime:
+            self._ctime_year = datetime.fromtimestamp(self.file_stat.st_ctime).year
         return self
 
     def __call__(self, obj: T) -> tuple[datetime | None, T]:
@@ -143,43 +274,69 @@ class TimestampedLineTransformer:
         if m:
             # create (datetime, str) tuple - clip leading datetime string from
             # the log string, so that it doesn't duplicate when presented
-            trimmed_obj = self._re_pattern_sub(self.sub_repl, obj).rstrip()
-            ret = self.str_to_time(m[self.timestamp_match_group]), trimmed_obj
+            # (trailing whitespace is stripped once, after removing escape sequences)
+            if self._clip_prefix:
+                trimmed_obj = obj[m.end():]
+            else:
+                trimmed_obj = self._re_pattern_sub(self.sub_repl, obj, 1)
+            ret = self._finalize(self.str_to_time(m[self.timestamp_match_group])), trimmed_obj
         else:
             # no leading timestamp, just return None and the original string
             ret = None, f" {obj}"
 
         # remove escape sequences, which throw off the tabularization of output
         # (consider replacing with rich tags)
-        if self.has_timezone and ret[0] is not None:
-            return ret[0].astimezone().replace(tzinfo=None), strip_escape_sequences(ret[1]).rstrip()
-        else:
-            return ret[0], strip_escape_sequences(ret[1]).rstrip()
+        return ret[0], _strip_esc(ret[1]).rstrip()
+
+    def transform_iter(self, lines: Iterable[T]) -> Generator[tuple[datetime | None, T], None, None]:
+        """
+        Transform a sequence of lines, giving the same results as map(self, lines), but
+        looking up the transformer's attributes once instead of on every line.
+        """
+        match = self._re_pattern_match
+        sub = self._re_pattern_sub
+        sub_repl = self.sub_repl
+        clip_prefix = self._clip_prefix
+        str_to_time = self.str_to_time
+        timestamp_match_group = self.timestamp_match_group
+        finalize = self._finalize
+        strip_esc = _strip_esc
+
+        for obj in lines:
+            m = match(obj)
+            if m:
+                trimmed_obj = obj[m.end():] if clip_prefix else sub(sub_repl, obj, 1)
+                yield finalize(str_to_time(m[timestamp_match_group])), strip_esc(trimmed_obj).rstrip()
+            else:
+                yield None, strip_esc(f" {obj}").rstrip()
 
 
 class YMDHMScommaFTZ(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DD HH:MM:SS,SSS<timezone>"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}\s?(?:Z|[+-]\d{4})"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
     has_timezone = True
 
     def __init__(self):
-        super().__init__(self.pattern, self.strptime_format)
+        super().__init__(self.pattern, _fromisoformat_comma)
 
 
 class YMDHMScommaF(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DD HH:MM:SS,SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
 
     def __init__(self):
-        super().__init__(self.pattern, self.strptime_format)
+        super().__init__(self.pattern, _fromisoformat_comma)
 
 
 class YMDHMSdotFZ(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DD HH:MM:SS.SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}\s?(?:Z|[+-]\d{4})"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -191,6 +348,7 @@ class YMDHMSdotFZ(TimestampedLineTransformer):
 
 class YMDHMSdotF(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DD HH:MM:SS.SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -201,6 +359,7 @@ class YMDHMSdotF(TimestampedLineTransformer):
 
 class YMDHMSZ(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DD HH:MM:SS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\s?(?:Z|[+-]\d{4})"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -212,6 +371,7 @@ class YMDHMSZ(TimestampedLineTransformer):
 
 class YMDHMS(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DD HH:MM:SS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -222,27 +382,30 @@ class YMDHMS(TimestampedLineTransformer):
 
 class YMDTHMScommaFZ(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DDTHH:MM:SS,SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2},\d{3}\s?(?:Z|[+-]\d{4})"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
     has_timezone = True
 
     def __init__(self):
-        super().__init__(self.pattern, self.strptime_format)
+        super().__init__(self.pattern, _fromisoformat_comma)
 
 
 class YMDTHMScommaF(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DDTHH:MM:SS,SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2},\d{3}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
 
     def __init__(self):
-        super().__init__(self.pattern, self.strptime_format)
+        super().__init__(self.pattern, _fromisoformat_comma)
 
 
 class YMDTHMSdotFZ(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DDTHH:MM:SS.SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}\s?(?:Z|[+-]\d{4}Z?)"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -254,6 +417,7 @@ class YMDTHMSdotFZ(TimestampedLineTransformer):
 
 class YMDTHMSdotF(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DDTHH:MM:SS.SSS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -264,6 +428,7 @@ class YMDTHMSdotF(TimestampedLineTransformer):
 
 class YMDTHMSZ(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DDTHH:MM:SS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\s?(?:Z|[+-]\d{4})"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -275,6 +440,7 @@ class YMDTHMSZ(TimestampedLineTransformer):
 
 class YMDTHMS(TimestampedLineTransformer):
     # log files with timestamp "YYYY-MM-DDTHH:MM:SS"
+    __slots__ = ()
     timestamp_pattern = r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = datetime.fromisoformat
@@ -286,56 +452,62 @@ class YMDTHMS(TimestampedLineTransformer):
 class BDHMS(TimestampedLineTransformer):
     # syslog files with timestamp "mon day hh:mm:ss"
     # (note, year is omitted so let's guess from the log file's create date)
+    __slots__ = ()
     timestamp_pattern = r"[JFMASOND][a-z]{2}\s(\s|\d)\d \d{2}:\d{2}:\d{2}"
     pattern = fr"(({timestamp_pattern})\s)"
     strptime_format = "%b %d %H:%M:%S"
 
     def __init__(self):
-        super().__init__(self.pattern, self.strptime_format)
+        super().__init__(self.pattern, _parse_bdhms)
 
     def __call__(self, obj: T) -> tuple[datetime | None, T]:
         # this format does not have a year so assume the file's create time year
-        if self.file_stat is not None and self.file_stat.st_ctime:
-            date_year = datetime.fromtimestamp(self.file_stat.st_ctime).year
-        else:
-            date_year = datetime.now().year
-
         dt, obj = super().__call__(obj)
         if dt is not None:
-            dt = dt.replace(year=date_year)
+            dt = dt.replace(year=self._ctime_year)
         return dt, obj
 
+    def transform_iter(self, lines: Iterable[T]) -> Generator[tuple[datetime | None, T], None, None]:
+        # this format does not have a year so assume the file's create time year
+        date_year = self._ctime_year
+        for dt, obj in super().transform_iter(lines):
+            if dt is not None:
+                dt = dt.replace(year=date_year)
+            yield dt, obj
+
 
 class PythonHttpServerLog(TimestampedLineTransformer):
     # ::1 - - [22/Sep/2023 21:58:40] "GET /log1.txt HTTP/1.1" 200 -
+    __slots__ = ()
     timestamp_pattern = r"\d{2}\/\w+\/\d{4} \d{2}:\d{2}:\d{2}"
     pattern = fr"(.*)(- \[({timestamp_pattern})\]\s)"
     strptime_format = "%d/%b/%Y %H:%M:%S"
     timestamp_match_group = 3
     sub_repl = r"\1"
+    required_text = "- ["
 
     def __init__(self):
-        super().__init__(self.pattern, self.strptime_format)
+        super().__init__(self.pattern, _parse_dby_hms)
 
 
 class HttpServerAccessLog(TimestampedLineTransformer):
     # 91.194.60.14 - - [16/Sep/2023:19:05:06 +0000] "GET /python_nutshell_app_a_search HTTP/1.1" 200 1027 "-"
     #   "http.rb/5.1.1 (Mastodon/4.1.3; +https://mamot.fr/) Bot" "91.194.60.14" response-time=0.002
+    __slots__ = ()
     timestamp_pattern = r"\d{2}\/\w+\/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}"
     pattern = fr"(.*)(- \[({timestamp_pattern})\]\s)"
     strptime_format = "%d/%b/%Y:%H:%M:%S %z"
     timestamp_match_group = 3
     sub_repl = r"\1"
+    required_text = "- ["
 
     def __init__(self):
-        super().__init__(
-            self.pattern,
-            lambda s: datetime.strptime(s, self.strptime_format).astimezone().replace(tzinfo=None)
-        )
+        super().__init__(self.pattern, lambda s: _parse_dby_hms_tz(s).astimezone().replace(tzinfo=None))
 
 
 class FloatSecondsSinceEpoch(TimestampedLineTransformer):
     # log files with timestamp "1694561169.550987" or "1694561169.550"
+    __slots__ = ()
     timestamp_pattern = r"\d{10}\.\d+"
     pattern = fr"(({timestamp_pattern})\s)"
 
@@ -345,6 +517,7 @@ class FloatSecondsSinceEpoch(TimestampedLineTransformer):
 
 class MilliSecondsSinceEpoch(TimestampedLineTransformer):
     # log files with 13-digit timestamp "1694561169550"
+    __slots__ = ()
     timestamp_pattern = r"\d{13}"
     pattern = fr"(({timestamp_pattern})\s)"
 
@@ -354,6 +527,7 @@ class MilliSecondsSinceEpoch(TimestampedLineTransformer):
 
 class SecondsSinceEpoch(TimestampedLineTransformer):
     # log files with 10-digit timestamp "1694561169"
+    __slots__ = ()
     timestamp_pattern = r"\d{10}"
     pattern = fr"(({timestamp_pattern})\s)"
 
@@ -361,11 +535,15 @@ class SecondsSinceEpoch(TimestampedLineTransformer):
         super().__init__(self.pattern, lambda s: datetime.fromtimestamp(int(s)))
 
 
+# snapshot of the builtin transformers, before any custom transformers get added
+_BUILTIN_SUBCLASSES = tuple(TimestampedLineTransformer.__subclasses__())
+
+
 if __name__ == '__main__':
     files = "log1.txt log3.txt syslog1.txt".split()
     file_dir = Path(__file__).parent.parent / "files"
     xformers = [TimestampedLineTransformer.make_transformer_from_file(file_dir / f) for f in files]
     for fname, xform in zip(files, xformers):
-        log_lines = (file_dir / fname).read_text().splitlines()
-        for ln in log_lines[:3]:
-            print(xform(ln))
+        with open(file_dir / fname) as log_file:
+            for xformed in xform.transform_iter(map(str.rstrip, itertools.islice(log_file, 3))):
+                print(xformed)